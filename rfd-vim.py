@@ -15,27 +15,203 @@ import sys
 import os
 import re
 import pymol
-from pymol import cmd
+from pymol import cmd, stored
 import argparse
+import queue
 import threading
 import time
-from collections import defaultdict
+import traceback
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
 from contextlib import contextmanager
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from types import MappingProxyType
+
+# How often the editing loop wakes up to look for a new PyMOL selection (seconds)
+SELECTION_POLL_INTERVAL = 0.25
+
+# Chain letter followed by a residue number or range, e.g. A87 or A2-15
+RANGE_RE = re.compile(r'([A-Z])(\d+)(?:-(\d+))?')
+
+# Quoted settings as written by save_settings or found in RFdiffusion scripts (spaces around = allowed)
+CONTIGS_RE = re.compile(r'CONTIGS\s*=\s*"([^"]*)"')
+INPAINT_RE = re.compile(r'INPAINT_SEQ\s*=\s*"([^"]*)"')
+POCKET_RE = re.compile(r'POCKET_RESIDUES\s*=\s*"([^"]*)"')
+
+# Residue states, interned so every stored state is the same object as these constants
+STATE_BT = sys.intern('BT')  # Backbone + type frozen
+STATE_B = sys.intern('B')    # Backbone only frozen
+STATE_N = sys.intern('N')    # Not frozen
+STATE_P = sys.intern('P')    # Pocket toggle (tracked in pocket_residues, not residue_states)
+
+# States whose residues are written to CONTIGS, and every state the editing loop accepts
+FROZEN_STATES = frozenset((STATE_BT, STATE_B))
+EDIT_STATES = frozenset((STATE_BT, STATE_B, STATE_N, STATE_P))
+# Typed state name -> STATE_* constant, so stored states are always the constant objects
+_EDIT_STATE_BY_NAME = {state: state for state in EDIT_STATES}
+# Editing loop commands that leave editing mode, compared after .upper()
+QUIT_CHOICES = frozenset(('Q', 'DONE'))
+
+# Non-water hetero atoms, shown as purple sticks
+LIGAND_SELECTION = "hetatm and not name HOH"
+
+# Human-readable descriptions of residue states
+STATE_DESCRIPTIONS = {
+    STATE_BT: 'Backbone + Type frozen (green sticks)',
+    STATE_B: 'Backbone only frozen (orange lines)',
+    STATE_N: 'Not frozen (cyan cartoon)'
+}
+
+@lru_cache(maxsize=128)
+def _parse_ranges(range_str):
+    """Parse a CONTIGS-style string into a read-only {chain: (starts, ends)} mapping of merged ranges"""
+    ranges_by_chain = defaultdict(list)
+    for chain, start, end in RANGE_RE.findall(range_str):
+        ranges_by_chain[chain].append((int(start), int(end or start)))
+        
+    merged = {}
+    for chain, ranges in ranges_by_chain.items():
+        ranges.sort()
+        starts, ends = [], []
+        for start, end in ranges:
+            # Merge ranges that overlap or touch the previous one
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        merged[chain] = (tuple(starts), tuple(ends))
+    # The result is shared through lru_cache, so hand out a read-only view
+    return MappingProxyType(merged)
+
+def _remove_sorted(values, value):
+    """Remove a value from a sorted list"""
+    i = bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+
+def _group_consecutive(numbers):
+    """Group sorted numbers into (start, end) ranges of consecutive values"""
+    if not numbers:
+        return []
+        
+    ranges = []
+    start = end = numbers[0]
+    
+    # Iterate values directly; a run only breaks where the next number is not end + 1
+    for number in numbers[1:]:
+        if number != end + 1:
+            ranges.append((start, end))
+            start = number
+        end = number
+            
+    ranges.append((start, end))
+    return ranges
+
+class _ResnumStrings(dict):
+    """Residue number -> str cache, filled on first lookup"""
+    def __missing__(self, resnum):
+        text = self[resnum] = str(resnum)
+        return text
+
+# Shared by the range formatters so each residue number is converted to text only once
+_RESNUM_STRS = _ResnumStrings()
+
+def _format_ranges(chain_resnums):
+    """Format (chain, sorted resnums) pairs as a CONTIGS-style string, e.g. A2-15/A20-20/B5-9"""
+    # Single residues are written as A5-5, the range form RFdiffusion expects.
+    # join() gets a list, which it would otherwise build from a generator itself
+    return "/".join([
+        f"{chain}{_RESNUM_STRS[start]}-{_RESNUM_STRS[end]}"
+        for chain, resnums in chain_resnums
+        for start, end in _group_consecutive(resnums)
+    ])
+
+def _group_by_chain(residues):
+    """Group (chain, resnum) pairs into (chain, sorted resnums) pairs in chain order"""
+    # One sort orders both keys, so groupby yields each chain once with its numbers already sorted
+    return [
+        (chain, [resnum for _, resnum in group])
+        for chain, group in groupby(sorted(residues), key=itemgetter(0))
+    ]
+
+def _txt_candidates(name):
+    """Yield the file name as given, then with a .txt extension if it lacks one"""
+    yield name
+    if not name.endswith('.txt'):
+        yield name + '.txt'
+
+def _resi_token(resnum):
+    """Format a residue number for a PyMOL resi range (negative numbers need escaping)"""
+    return str(resnum) if resnum >= 0 else f"\\{resnum}"
+
+def _residue_selection(residues):
+    """Build a PyMOL selection with one compact resi range per chain, e.g. (chain A and resi 5-7+12)"""
+    clauses = []
+    for chain, resnums in _group_by_chain(residues):
+        ranges = _group_consecutive(resnums)
+        resi = "+".join(
+            _resi_token(start) if start == end else f"{_resi_token(start)}-{_resi_token(end)}"
+            for start, end in ranges
+        )
+        clauses.append(f"(chain {chain} and resi {resi})")
+        
+    return " or ".join(clauses)
+
+def _in_ranges(ranges_by_chain, chain, resnum):
+    """Check if a residue falls within ranges returned by _parse_ranges"""
+    if chain not in ranges_by_chain:
+        return False
+    starts, ends = ranges_by_chain[chain]
+    i = bisect_right(starts, resnum) - 1
+    return i >= 0 and resnum <= ends[i]
 
 class RFDVIMVisualizer:
-    def __init__(self):
+    def __init__(self, debug=False):
         self.pdb_file = None
+        self._debug = debug  # Print full tracebacks for handled errors
         self.current_dir = os.path.dirname(os.path.abspath(__file__))
+        # Directories known to exist, so saving does not call makedirs every time
+        self._dirs_ensured = {self.current_dir}
         
         # Track residue states: 'BT' = backbone+type frozen, 'B' = backbone only, 'N' = not frozen
-        self.residue_states = {}  # {(chain, resnum): state}
+        self.residue_states = {}  # {(chain, resnum): state} - change through _set_state
+        # Sorted resnums per chain kept in step with residue_states by _set_state
+        self._contigs_by_chain = defaultdict(list)  # BT and B states
+        self._inpaint_by_chain = defaultdict(list)  # B state only
+        self._settings_cache = None  # (CONTIGS, INPAINT_SEQ) until the next state change
+        self._visual_dirty = True  # Set when states, pockets or the structure change; cleared by visualize_current_states
         # Track pocket residues separately (can overlap with other states)
         self.pocket_residues = set()  # {(chain, resnum)} - residues marked as pocket
         self.protein_residues = set()  # All protein residues available
+        # Sorted residue numbers per chain, for slicing protein residues by range
+        self._chain_resnums = {}  # {chain: [resnum, ...]}
+        self._protein_chains = frozenset()  # Chains that contain protein residues
+        self._created_selections = set()  # Named selections made by this tool
+        self._has_ligand = False  # Set when a structure is loaded
         self._pymol_initialized = False
         
+        # Input from PyMOL commands and the terminal is pushed onto a queue;
+        # waiting for input blocks on the queue instead of busy-polling
+        self._input_queue = queue.Queue()
+        
         self.init_pymol()
         
+        # A single long-lived thread forwards terminal lines to the input queue
+        self._stdin_thread = threading.Thread(target=self._stdin_pump, daemon=True)
+        self._stdin_thread.start()
+        
+        # Main menu options 1-5; option 6 (exit) is handled by the menu loop itself
+        self._menu_dispatch = {
+            '1': self.start_interactive_editing,
+            '2': self.show_current_settings,
+            '3': self._menu_load_settings,
+            '4': self._menu_save_settings,
+            '5': self.save_pse_for_rmsd,
+        }
+        
     def init_pymol(self):
         """Initialize PyMOL session"""
         try:
@@ -46,6 +222,7 @@ class RFDVIMVisualizer:
             cmd.set("mouse_selection_mode", 1)  # Enable atom selection
             cmd.set("selection_width", 4)  # Make selections easier to see
             cmd.set("auto_zoom", 0)  # Don't auto-zoom on selections
+            cmd.set("defer_builds_mode", 3)  # Build representations only when drawn
             
             # Set up custom PyMOL commands for menu navigation
             self.setup_pymol_commands()
@@ -59,19 +236,18 @@ class RFDVIMVisualizer:
             
     def setup_pymol_commands(self):
         """Set up custom PyMOL commands for menu interaction"""
-        # Create shared variables for communication between PyMOL and Python
-        self.pymol_choice = None
+        # Current input mode, checked by the command handlers below
         self.pymol_input_mode = None  # 'menu', 'editing', etc.
         
         # Define PyMOL command functions
         def menu_choice(choice):
-            self.pymol_choice = str(choice)
+            self._post_input(str(choice))
             print(f"Menu choice {choice} selected in PyMOL")
             
         def residue_state(state):
             if self.pymol_input_mode == 'editing':
-                self.pymol_choice = str(state).upper()
-                if state.upper() == 'P':
+                self._post_input(str(state).upper())
+                if state == STATE_P:
                     print(f"Pocket residue toggle selected in PyMOL")
                 else:
                     print(f"Residue state {state} selected in PyMOL")
@@ -79,35 +255,35 @@ class RFDVIMVisualizer:
                 print("Not in editing mode - press '1' to start editing mode")
                 
         def done_editing():
-            self.pymol_choice = 'done'
+            self._post_input('done')
             print("Editing mode finished")
         
         # Command handlers for different modes
         def file(filename):
             if self.pymol_input_mode == 'loading':
-                self.pymol_choice = f"file {filename}"
+                self._post_input(f"file {filename}")
                 print(f"Loading file: {filename}")
             else:
-                self.pymol_choice = str(filename)
+                self._post_input(str(filename))
                 print(f"File path received: {filename}")
                 
         def fetch(pdb_id):
             if self.pymol_input_mode == 'loading':
-                self.pymol_choice = f"fetch {pdb_id}"
+                self._post_input(f"fetch {pdb_id}")
                 print(f"Fetching PDB: {pdb_id}")
             else:
                 print("Fetch command not available in this mode")
             
         # Register commands in PyMOL (both lowercase and uppercase)
         cmd.extend('menu', menu_choice)
-        cmd.extend('bt', lambda: residue_state('BT'))
-        cmd.extend('BT', lambda: residue_state('BT'))
-        cmd.extend('b', lambda: residue_state('B'))  
-        cmd.extend('B', lambda: residue_state('B'))
-        cmd.extend('p', lambda: residue_state('P'))  # New pocket command
-        cmd.extend('P', lambda: residue_state('P'))  # New pocket command
-        cmd.extend('n', lambda: residue_state('N'))
-        cmd.extend('N', lambda: residue_state('N'))
+        cmd.extend('bt', lambda: residue_state(STATE_BT))
+        cmd.extend('BT', lambda: residue_state(STATE_BT))
+        cmd.extend('b', lambda: residue_state(STATE_B))  
+        cmd.extend('B', lambda: residue_state(STATE_B))
+        cmd.extend('p', lambda: residue_state(STATE_P))  # New pocket command
+        cmd.extend('P', lambda: residue_state(STATE_P))  # New pocket command
+        cmd.extend('n', lambda: residue_state(STATE_N))
+        cmd.extend('N', lambda: residue_state(STATE_N))
         cmd.extend('q', lambda: residue_state('Q'))
         cmd.extend('Q', lambda: residue_state('Q'))
         cmd.extend('done', done_editing)
@@ -118,6 +294,49 @@ class RFDVIMVisualizer:
         for i in range(1, 7):  # Updated to include 6
             cmd.extend(str(i), lambda x=i: menu_choice(x))
             
+    def _select(self, name, selection, enable=1):
+        """Create a named PyMOL selection and remember it for reset_selection_state"""
+        cmd.select(name, selection, enable=enable)
+        self._created_selections.add(name)
+        
+    @contextmanager
+    def _batched(self):
+        """Suspend PyMOL scene updates for a group of commands, then redraw once"""
+        cmd.set("suspend_updates", 1)
+        try:
+            yield
+        finally:
+            cmd.set("suspend_updates", 0)
+            cmd.refresh()
+            
+    def _post_input(self, value):
+        """Queue input from PyMOL or the terminal for the waiting loop"""
+        # queue.Queue is thread-safe, PyMOL calls this from its own thread
+        self._input_queue.put(value)
+        
+    def _clear_input(self):
+        """Discard any input that has not been consumed yet"""
+        while True:
+            try:
+                self._input_queue.get_nowait()
+            except queue.Empty:
+                return
+                
+    def _wait_for_input(self, timeout=None):
+        """Block until input arrives; return it, or None if the timeout expires"""
+        try:
+            return self._input_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+            
+    def _stdin_pump(self):
+        """Forward each terminal line to the input queue until stdin closes"""
+        while True:
+            try:
+                self._post_input(input().strip())
+            except EOFError:
+                return
+                
     def get_input(self, prompt, valid_choices=None, allow_string=True):
         """Get input from PyMOL command line or terminal"""
         print(f"{prompt}")
@@ -128,57 +347,20 @@ class RFDVIMVisualizer:
             else:
                 print("Type in PyMOL.")
         
-        # Reset PyMOL choice
-        self.pymol_choice = None
+        # Drop stale input left over from a previous prompt
+        self._clear_input()
         
-        # Start a thread to wait for terminal input
-        terminal_input = None
-        stop_input_thread = threading.Event()
-        
-        def get_terminal_input():
-            nonlocal terminal_input
-            try:
-                terminal_input = input().strip()
-            except (EOFError, KeyboardInterrupt):
-                pass
-                
-        input_thread = threading.Thread(target=get_terminal_input)
-        input_thread.daemon = True
-        input_thread.start()
-        
-        # Wait for either terminal input or PyMOL command
+        # Wait for either terminal input or PyMOL command. Wait in short timed slices:
+        # an untimed lock wait cannot be interrupted by Ctrl+C on Windows before Python 3.14
         while True:
-            time.sleep(0.05)  # Reduced delay for better responsiveness
+            choice = self._wait_for_input(timeout=SELECTION_POLL_INTERVAL)
+            if choice is None:
+                continue
             
-            # Check if PyMOL command was entered
-            if self.pymol_choice is not None:
-                choice = self.pymol_choice
-                self.pymol_choice = None
-                if valid_choices is None or choice in valid_choices or allow_string:
-                    return choice
-                else:
-                    print(f"Invalid choice: {choice}. Valid options: {valid_choices}")
-                
-            # Check if terminal input was entered
-            if terminal_input is not None:
-                if valid_choices is None or terminal_input in valid_choices or allow_string:
-                    return terminal_input
-                else:
-                    print(f"Invalid choice: {terminal_input}. Valid options: {valid_choices}")
-                    # Restart input thread
-                    terminal_input = None
-                    if input_thread.is_alive():
-                        input_thread.join(timeout=0.1)
-                    input_thread = threading.Thread(target=get_terminal_input)
-                    input_thread.daemon = True
-                    input_thread.start()
-                
-            # Check if thread finished (user pressed Enter with no input)
-            if not input_thread.is_alive() and terminal_input is None:
-                # Restart input thread for empty input
-                input_thread = threading.Thread(target=get_terminal_input)
-                input_thread.daemon = True
-                input_thread.start()
+            if valid_choices is None or choice in valid_choices or allow_string:
+                return choice
+            else:
+                print(f"Invalid choice: {choice}. Valid options: {valid_choices}")
             
     def browse_pdb_file(self):
         """Allow user to load PDB file or fetch from PDB with streamlined input"""
@@ -210,8 +392,7 @@ class RFDVIMVisualizer:
                     return self.fetch_pdb_structure(parts[1])
             elif user_input == '6':
                 print("Goodbye!")
-                cmd.quit()
-                pymol.finish_launching()
+                self.cleanup()
                 sys.exit(0)
             else:
                 print("Invalid command. Use: 'file filename.pdb', 'fetch 1ABC', or '6'")  # Updated from '5' to '7'
@@ -246,47 +427,48 @@ class RFDVIMVisualizer:
             
         try:
             print(f"Fetching PDB structure {pdb_id}...")
-            cmd.delete("all")
-            cmd.fetch(pdb_id, "protein")
-            cmd.show("cartoon", "protein")
-            cmd.color("cyan", "protein")
-            cmd.zoom("protein")
-            
-            # Set the pdb_file to indicate it was fetched
-            self.pdb_file = f"PDB:{pdb_id}"
-            
-            # Discover all protein residues (same as load_pdb)
-            cmd.select("protein_residues", "protein and polymer")
-            
-            from pymol import stored
-            stored.residues = []
-            
-            if hasattr(stored, 'selected_residues'):
-                stored.selected_residues = []
-            
-            cmd.iterate("protein_residues", "stored.residues.append((chain, resi))")
-            
-            for chain, resi in stored.residues:
-                key = (chain, int(resi))
-                self.protein_residues.add(key)
-                if key not in self.residue_states:
-                    self.residue_states[key] = 'N'
-                    
-            print(f"Successfully fetched PDB structure: {pdb_id}")
-            print(f"Found {len(self.protein_residues)} protein residues")
-            
-            # Color ligand purple if present
-            try:
-                cmd.select("ligand", "hetatm and not name HOH")
-                if cmd.count_atoms("ligand") > 0:
-                    cmd.show("sticks", "ligand")
-                    cmd.set_color("ligand_purple", [0.6, 0.2, 0.8])
-                    cmd.color("ligand_purple", "ligand")
-                    print("Ligand shown as purple sticks")
-                cmd.deselect()
-            except Exception as ligand_error:
-                print(f"Note: Could not process ligand: {ligand_error}")
+            with self._batched():
+                cmd.delete("all")
+                cmd.fetch(pdb_id, "protein")
+                cmd.show("cartoon", "protein")
+                cmd.color("cyan", "protein")
+                cmd.zoom("protein")
+                
+                # Set the pdb_file to indicate it was fetched
+                self.pdb_file = f"PDB:{pdb_id}"
+                
+                # Discover all protein residues (same as load_pdb)
+                self._select("protein_residues", "protein and polymer and name CA")
+                
+                stored.residues = []
+                
+                if hasattr(stored, 'selected_residues'):
+                    stored.selected_residues = []
+                
+                cmd.iterate("protein_residues", "stored.residues.append((chain, resv))")
                 
+                for key in stored.residues:
+                    self.protein_residues.add(key)
+                    if key not in self.residue_states:
+                        self.residue_states[key] = STATE_N
+                self._index_protein_residues()
+                        
+                print(f"Successfully fetched PDB structure: {pdb_id}")
+                print(f"Found {len(self.protein_residues)} protein residues")
+                
+                # Color ligand purple if present
+                try:
+                    self._select("ligand", LIGAND_SELECTION)
+                    self._has_ligand = cmd.count_atoms("ligand") > 0
+                    if self._has_ligand:
+                        cmd.show("sticks", "ligand")
+                        cmd.set_color("ligand_purple", [0.6, 0.2, 0.8])
+                        cmd.color("ligand_purple", "ligand")
+                        print("Ligand shown as purple sticks")
+                    cmd.deselect()
+                except Exception as ligand_error:
+                    print(f"Note: Could not process ligand: {ligand_error}")
+                    
             return True
             
         except Exception as e:
@@ -303,54 +485,89 @@ class RFDVIMVisualizer:
             return False
             
         try:
-            cmd.delete("all")  # Clear existing objects instead of reinitializing
-            cmd.load(pdb_file, "protein")
-            cmd.show("cartoon", "protein")
-            cmd.color("cyan", "protein")
-            cmd.zoom("protein")
-            self.pdb_file = pdb_file
-            
-            # Discover all protein residues
-            cmd.select("protein_residues", "protein and polymer")
-            
-            # Use PyMOL's built-in stored object
-            from pymol import stored
-            stored.residues = []
-            
-            # Clear any existing stored data
-            if hasattr(stored, 'selected_residues'):
-                stored.selected_residues = []
-            
-            cmd.iterate("protein_residues", "stored.residues.append((chain, resi))")
-            
-            for chain, resi in stored.residues:
-                key = (chain, int(resi))
-                self.protein_residues.add(key)
-                if key not in self.residue_states:
-                    self.residue_states[key] = 'N'  # Default to not frozen
-                    
-            print(f"Loaded PDB file: {pdb_file}")
-            print(f"Found {len(self.protein_residues)} protein residues")
-            
-            # Color ligand purple if present
-            try:
-                cmd.select("ligand", "hetatm and not name HOH")
-                if cmd.count_atoms("ligand") > 0:
-                    cmd.show("sticks", "ligand")
-                    cmd.set_color("ligand_purple", [0.6, 0.2, 0.8])
-                    cmd.color("ligand_purple", "ligand")
-                    print("Ligand showed as purple sticks")
-                cmd.deselect()
-            except Exception as ligand_error:
-                print(f"Note: Could not process ligand: {ligand_error}")
+            with self._batched():
+                cmd.delete("all")  # Clear existing objects instead of reinitializing
+                cmd.load(pdb_file, "protein")
+                cmd.show("cartoon", "protein")
+                cmd.color("cyan", "protein")
+                cmd.zoom("protein")
+                self.pdb_file = pdb_file
                 
+                # Discover all protein residues (one CA atom per residue)
+                self._select("protein_residues", "protein and polymer and name CA")
+                
+                # Use PyMOL's built-in stored object
+                stored.residues = []
+                
+                # Clear any existing stored data
+                if hasattr(stored, 'selected_residues'):
+                    stored.selected_residues = []
+                
+                cmd.iterate("protein_residues", "stored.residues.append((chain, resv))")
+                
+                for key in stored.residues:
+                    self.protein_residues.add(key)
+                    if key not in self.residue_states:
+                        self.residue_states[key] = STATE_N  # Default to not frozen
+                self._index_protein_residues()
+                        
+                print(f"Loaded PDB file: {pdb_file}")
+                print(f"Found {len(self.protein_residues)} protein residues")
+                
+                # Color ligand purple if present
+                try:
+                    self._select("ligand", LIGAND_SELECTION)
+                    self._has_ligand = cmd.count_atoms("ligand") > 0
+                    if self._has_ligand:
+                        cmd.show("sticks", "ligand")
+                        cmd.set_color("ligand_purple", [0.6, 0.2, 0.8])
+                        cmd.color("ligand_purple", "ligand")
+                        print("Ligand showed as purple sticks")
+                    cmd.deselect()
+                except Exception as ligand_error:
+                    print(f"Note: Could not process ligand: {ligand_error}")
+                    
             return True
         except Exception as e:
             print(f"Error loading PDB: {e}")
-            import traceback
-            traceback.print_exc()
+            if self._debug:
+                traceback.print_exc()
             return False
             
+    def _index_protein_residues(self):
+        """Rebuild the sorted per-chain residue number lists and chain set from protein_residues"""
+        self._chain_resnums = dict(_group_by_chain(self.protein_residues))
+        self._protein_chains = frozenset(self._chain_resnums)
+        self._visual_dirty = True
+        
+    def _protein_residues_in(self, ranges_by_chain):
+        """Yield protein residues covered by ranges from _parse_ranges, one bisect slice per range"""
+        for chain, (starts, ends) in ranges_by_chain.items():
+            resnums = self._chain_resnums.get(chain, [])
+            for start, end in zip(starts, ends):
+                lo = bisect_left(resnums, start)
+                hi = bisect_right(resnums, end, lo)
+                for resnum in resnums[lo:hi]:
+                    yield chain, resnum
+                    
+    def _extract_settings(self, path, last=False):
+        """Read a file once and return its CONTIGS, INPAINT_SEQ and POCKET_RESIDUES (None if missing)"""
+        with open(path, 'r') as f:
+            content = f.read()
+            
+        # Scripts use the first match of each setting; saved files pass last=True so a
+        # later line overrides an earlier (e.g. commented-out) one, as line-by-line parsing did
+        values = []
+        for pattern in (CONTIGS_RE, INPAINT_RE, POCKET_RE):
+            if last:
+                match = None
+                for match in pattern.finditer(content):
+                    pass
+            else:
+                match = pattern.search(content)
+            values.append(match.group(1) if match else None)
+        return tuple(values)
+        
     def load_from_script(self, script_file):
         """Load CONTIGS and INPAINT_SEQ from script file"""
         if not os.path.exists(script_file):
@@ -358,15 +575,10 @@ class RFDVIMVisualizer:
             return False
             
         try:
-            with open(script_file, 'r') as f:
-                content = f.read()
-                
-            # Extract and parse CONTIGS
-            contigs_match = re.search(r'CONTIGS="([^"]*)"', content)
-            inpaint_match = re.search(r'INPAINT_SEQ="([^"]*)"', content)
+            contigs, inpaint_seq, _ = self._extract_settings(script_file)
             
-            if contigs_match and inpaint_match:
-                self.parse_and_set_states(contigs_match.group(1), inpaint_match.group(1))
+            if contigs is not None and inpaint_seq is not None:
+                self.parse_and_set_states(contigs, inpaint_seq)
                 self.visualize_current_states()
                 print(f"Loaded settings from {os.path.basename(script_file)}")
                 return True
@@ -400,59 +612,8 @@ class RFDVIMVisualizer:
         save_file = file_path
             
         try:
-            with open(save_file, 'r') as f:
-                lines = f.readlines()
-                
-            contigs = None
-            inpaint_seq = None
-            pocket_residues = None
+            contigs, inpaint_seq, pocket_residues = self._extract_settings(save_file, last=True)
             
-            # Try both regex and direct parsing for robustness
-            for line in lines:
-                line = line.strip()
-                # Try regex match first
-                contigs_match = re.search(r'CONTIGS="([^"]*)"', line)
-                inpaint_match = re.search(r'INPAINT_SEQ="([^"]*)"', line)
-                pocket_match = re.search(r'POCKET_RESIDUES="([^"]*)"', line)
-                
-                if contigs_match:
-                    contigs = contigs_match.group(1)
-                if inpaint_match:
-                    inpaint_seq = inpaint_match.group(1)
-                if pocket_match:
-                    pocket_residues = pocket_match.group(1)
-                
-                # If regex fails, try direct parsing
-                if contigs is None and line.startswith('CONTIGS='):
-                    try:
-                        parts = line.split('=', 1)
-                        if len(parts) > 1:
-                            val = parts[1].strip()
-                            if val.startswith('"') and val.endswith('"'):
-                                contigs = val[1:-1]
-                    except:
-                        pass
-                        
-                if inpaint_seq is None and line.startswith('INPAINT_SEQ='):
-                    try:
-                        parts = line.split('=', 1)
-                        if len(parts) > 1:
-                            val = parts[1].strip()
-                            if val.startswith('"') and val.endswith('"'):
-                                inpaint_seq = val[1:-1]
-                    except:
-                        pass
-                        
-                if pocket_residues is None and line.startswith('POCKET_RESIDUES='):
-                    try:
-                        parts = line.split('=', 1)
-                        if len(parts) > 1:
-                            val = parts[1].strip()
-                            if val.startswith('"') and val.endswith('"'):
-                                pocket_residues = val[1:-1]
-                    except:
-                        pass
-                    
             if contigs is not None and inpaint_seq is not None:
                 self.parse_and_set_states(contigs, inpaint_seq)
                 if pocket_residues is not None:
@@ -466,150 +627,126 @@ class RFDVIMVisualizer:
                 
         except Exception as e:
             print(f"Error loading save file: {e}")
-            import traceback
-            traceback.print_exc()
+            if self._debug:
+                traceback.print_exc()
             return False
             
+    def _set_state(self, res_key, new_state):
+        """Set a residue state and update the sorted CONTIGS/INPAINT_SEQ residue lists"""
+        old_state = self.residue_states.get(res_key, STATE_N)
+        self.residue_states[res_key] = new_state
+        if old_state == new_state:
+            return
+            
+        chain, resnum = res_key
+        was_frozen = old_state in FROZEN_STATES
+        is_frozen = new_state in FROZEN_STATES
+        if was_frozen and not is_frozen:
+            _remove_sorted(self._contigs_by_chain[chain], resnum)
+        elif is_frozen and not was_frozen:
+            insort(self._contigs_by_chain[chain], resnum)
+        if old_state == STATE_B:
+            _remove_sorted(self._inpaint_by_chain[chain], resnum)
+        elif new_state == STATE_B:
+            insort(self._inpaint_by_chain[chain], resnum)
+            
+        self._settings_cache = None
+        self._visual_dirty = True
+        
     def parse_and_set_states(self, contigs_str, inpaint_str):
         """Parse CONTIGS and INPAINT_SEQ strings and set residue states"""
         # Reset all states
-        for key in self.residue_states:
-            self.residue_states[key] = 'N'
-            
-        # Parse CONTIGS - residues that should be kept
-        contigs_residues = set()
-        parts = contigs_str.split('/')
-        for part in parts:
-            part = part.strip()
-            if part:
-                if '-' in part:
-                    # Handle chain letter + range (e.g., A2-15)
-                    chain_match = re.match(r'([A-Z])(\d+)-(\d+)', part)
-                    if chain_match:
-                        chain, start, end = chain_match.groups()
-                        for res in range(int(start), int(end) + 1):
-                            contigs_residues.add((chain, res))
-                else:
-                    # Handle single residue (e.g., A87)
-                    single_match = re.match(r'([A-Z])(\d+)', part)
-                    if single_match:
-                        chain, resnum = single_match.groups()
-                        contigs_residues.add((chain, int(resnum)))
-                        
-        # Parse INPAINT_SEQ - residues whose sequence can change
-        inpaint_residues = set()
-        parts = inpaint_str.split('/')
-        for part in parts:
-            part = part.strip()
-            if part:
-                if '-' in part:
-                    # Handle chain letter + range (e.g., A2-15)
-                    chain_match = re.match(r'([A-Z])(\d+)-(\d+)', part)
-                    if chain_match:
-                        chain, start, end = chain_match.groups()
-                        for res in range(int(start), int(end) + 1):
-                            inpaint_residues.add((chain, res))
-                else:
-                    # Handle single residue (e.g., A87)
-                    single_match = re.match(r'([A-Z])(\d+)', part)
-                    if single_match:
-                        chain, resnum = single_match.groups()
-                        inpaint_residues.add((chain, int(resnum)))
-                    
-        # Set states based on membership
-        for chain_res in contigs_residues:
-            if chain_res in self.protein_residues:
-                if chain_res in inpaint_residues:
-                    self.residue_states[chain_res] = 'B'  # Backbone only
-                else:
-                    self.residue_states[chain_res] = 'BT'  # Backbone + type
+        self.residue_states = dict.fromkeys(self.residue_states, STATE_N)
+        self._contigs_by_chain.clear()
+        self._inpaint_by_chain.clear()
+        self._settings_cache = None
+        self._visual_dirty = True
+        
+        # CONTIGS - residues that should be kept
+        contigs_ranges = _parse_ranges(contigs_str)
+        # INPAINT_SEQ - residues whose sequence can change
+        inpaint_ranges = _parse_ranges(inpaint_str)
+        
+        # Set states based on membership, counting them as we go
+        counts = Counter()
+        for chain, resnum in self._protein_residues_in(contigs_ranges):
+            if _in_ranges(inpaint_ranges, chain, resnum):
+                state = STATE_B  # Backbone only
+            else:
+                state = STATE_BT  # Backbone + type
+            self._set_state((chain, resnum), state)
+            counts[state] += 1
                     
-        print(f"Set {len([s for s in self.residue_states.values() if s == 'BT'])} fully frozen residues")
-        print(f"Set {len([s for s in self.residue_states.values() if s == 'B'])} backbone-only frozen residues")
+        print(f"Set {counts[STATE_BT]} fully frozen residues")
+        print(f"Set {counts[STATE_B]} backbone-only frozen residues")
         
     def parse_pocket_residues(self, pocket_str):
         """Parse POCKET_RESIDUES string and set pocket residues"""
         # Clear current pocket residues
         self.pocket_residues.clear()
+        self._visual_dirty = True
         
         if not pocket_str:
             return
             
         # Parse POCKET_RESIDUES - residues marked as pocket
-        parts = pocket_str.split('/')
-        for part in parts:
-            part = part.strip()
-            if part:
-                if '-' in part:
-                    # Handle chain letter + range (e.g., A2-15)
-                    chain_match = re.match(r'([A-Z])(\d+)-(\d+)', part)
-                    if chain_match:
-                        chain, start, end = chain_match.groups()
-                        for res in range(int(start), int(end) + 1):
-                            res_key = (chain, res)
-                            if res_key in self.protein_residues:
-                                self.pocket_residues.add(res_key)
-                else:
-                    # Handle single residue (e.g., A87)
-                    single_match = re.match(r'([A-Z])(\d+)', part)
-                    if single_match:
-                        chain, resnum = single_match.groups()
-                        res_key = (chain, int(resnum))
-                        if res_key in self.protein_residues:
-                            self.pocket_residues.add(res_key)
+        pocket_ranges = _parse_ranges(pocket_str)
+        self.pocket_residues.update(self._protein_residues_in(pocket_ranges))
                             
         print(f"Set {len(self.pocket_residues)} pocket residues")
         
     def visualize_current_states(self):
         """Visualize current residue states in PyMOL"""
-        # Clear previous protein visualizations only
-        cmd.hide("everything", "protein")
-        cmd.show("cartoon", "protein")
-        cmd.color("cyan", "protein")
-        
-        # Group residues by state
-        bt_residues = []  # Backbone + type frozen
-        b_residues = []   # Backbone only frozen
-        
-        for (chain, resnum), state in self.residue_states.items():
-            if state == 'BT':
-                bt_residues.append(f"chain {chain} and resi {resnum}")
-            elif state == 'B':
-                b_residues.append(f"chain {chain} and resi {resnum}")
-                
-        # Visualize fully frozen (BT) as green sticks
-        if bt_residues:
-            cmd.select("frozen_bt", " or ".join(bt_residues))
-            cmd.show("sticks", "frozen_bt")
-            cmd.color("green", "frozen_bt")
+        with self._batched():
+            # Clear previous protein visualizations only
+            cmd.hide("everything", "protein")
+            cmd.show("cartoon", "protein")
+            cmd.color("cyan", "protein")
             
-        # Visualize backbone frozen (B) as orange lines
-        if b_residues:
-            cmd.select("frozen_b", " or ".join(b_residues))
-            cmd.show("lines", "frozen_b")
-            cmd.set_color("frozen_orange", [1.0, 0.5, 0.0])
-            cmd.color("frozen_orange", "frozen_b")
+            # Group residues by state from the sorted lists kept by _set_state,
+            # so unfrozen residues are never scanned
+            bt_residues = []  # Backbone + type frozen
+            b_residues = []   # Backbone only frozen
             
-        # Visualize pocket residues as dark green sticks (can overlap with other states)
-        if self.pocket_residues:
-            p_residues = [f"chain {chain} and resi {resnum}" for chain, resnum in self.pocket_residues]
-            cmd.select("pocket", " or ".join(p_residues))
-            cmd.show("sticks", "pocket")
-            cmd.set_color("dark_green", [0.0, 0.6, 0.0])
-            cmd.color("dark_green", "pocket")
-        
-        # Ensure ligand remains visible
-        try:
-            cmd.select("ligand", "hetatm and not name HOH")
-            if cmd.count_atoms("ligand") > 0:
-                cmd.show("sticks", "ligand")
-                cmd.set_color("ligand_purple", [0.6, 0.2, 0.8])
-                cmd.color("ligand_purple", "ligand")
-        except Exception as e:
-            print(f"Warning: Error handling ligand: {e}")
+            for chain, resnums in sorted(self._contigs_by_chain.items(), key=itemgetter(0)):
+                inpaint = set(self._inpaint_by_chain.get(chain, ()))
+                for resnum in resnums:
+                    if resnum in inpaint:
+                        b_residues.append((chain, resnum))
+                    else:
+                        bt_residues.append((chain, resnum))
+                    
+            # Visualize fully frozen (BT) as green sticks
+            if bt_residues:
+                self._select("frozen_bt", _residue_selection(bt_residues))
+                cmd.show("sticks", "frozen_bt")
+                cmd.color("green", "frozen_bt")
+                
+            # Visualize backbone frozen (B) as orange lines
+            if b_residues:
+                self._select("frozen_b", _residue_selection(b_residues))
+                cmd.show("lines", "frozen_b")
+                cmd.set_color("frozen_orange", [1.0, 0.5, 0.0])
+                cmd.color("frozen_orange", "frozen_b")
+                
+            # Visualize pocket residues as dark green sticks (can overlap with other states)
+            if self.pocket_residues:
+                self._select("pocket", _residue_selection(self.pocket_residues))
+                cmd.show("sticks", "pocket")
+                cmd.set_color("dark_green", [0.0, 0.6, 0.0])
+                cmd.color("dark_green", "pocket")
             
-        cmd.deselect()
-        
+            # Ensure ligand remains visible (it was hidden and recolored with the protein above)
+            if self._has_ligand:
+                try:
+                    cmd.show("sticks", LIGAND_SELECTION)
+                    cmd.color("ligand_purple", LIGAND_SELECTION)
+                except Exception as e:
+                    print(f"Warning: Error handling ligand: {e}")
+                
+            cmd.deselect()
+            
+        self._visual_dirty = False
         print(f"\nVisualized: {len(bt_residues)} fully frozen (green sticks), {len(b_residues)} backbone-only (orange lines), {len(self.pocket_residues)} pocket (dark green sticks)")
         
     def reset_selection_state(self):
@@ -618,21 +755,17 @@ class RFDVIMVisualizer:
             # Clear all PyMOL selections
             cmd.deselect()
             
-            # Clear any named selections that might exist
-            selections = cmd.get_names("selections")
-            for sel in selections:
-                cmd.delete(sel)
+            # Delete the user's selection and our own named selections in one call
+            self._created_selections.add("sele")
+            cmd.delete(" ".join(self._created_selections))
+            self._created_selections.clear()
             
             # Reset internal choice tracking
-            self.pymol_choice = None
+            self._clear_input()
             
             # Make sure any stored variables are cleared
-            from pymol import stored
             stored.selected_residues = []
             
-            # Small delay to ensure PyMOL processes the clearing
-            time.sleep(0.02)
-            
             # Additional step: attempt to clear the selection via mouse mode
             cmd.mouse('three_button_viewing')
             
@@ -640,7 +773,17 @@ class RFDVIMVisualizer:
             print(f"Warning: Could not fully reset selection state: {e}")
             # Fallback: just clear basic selection
             cmd.deselect()
-            self.pymol_choice = None
+            self._clear_input()
+        
+    def _read_selected_residues(self):
+        """Return the unique (chain, resnum) protein residues in the current 'sele' selection"""
+        stored.selected_residues = []
+        cmd.iterate("(byres sele) and name CA", "stored.selected_residues.append((chain, resv))")
+        
+        # Remove duplicates (e.g. alternate CA locations) while preserving order
+        return list(dict.fromkeys(
+            res for res in stored.selected_residues if res[0] in self._protein_chains  # Only protein chains
+        ))
         
     def start_interactive_editing(self):
         """Start interactive editing mode"""
@@ -669,183 +812,96 @@ class RFDVIMVisualizer:
         
         try:
             while True:
-                time.sleep(0.05)  # Reduced delay for better responsiveness
+                # Sleep until a command arrives, waking periodically to check the selection
+                choice = self._wait_for_input(timeout=SELECTION_POLL_INTERVAL)
                 
                 # Check if user typed 'done' or 'q' in PyMOL
-                if self.pymol_choice:
-                    if self.pymol_choice.lower() in ['done', 'q']:
-                        print("Exiting editing mode...")
-                        return
-                    self.pymol_choice = None
+                if choice and choice.upper() in QUIT_CHOICES:
+                    print("Exiting editing mode...")
+                    return
                 
                 # Check for current selection
                 selection = cmd.get_names("selections")
                 if selection and "sele" in selection:
-                    # Get current selection signature to avoid re-processing
-                    current_selection_signature = cmd.count_atoms("sele")
+                    # Get all selected residues (supports multiple selection)
+                    try:
+                        unique_residues = self._read_selected_residues()
+                    except Exception as e:
+                        print(f"Error reading selected residue: {e}")
+                        self.reset_selection_state()
+                        last_processed_selection = None
+                        continue
+                        
+                    # Use the selected residues as the signature to avoid re-processing;
+                    # an atom count is not enough, different selections can share one
+                    current_selection_signature = frozenset(unique_residues)
                     
                     # Only process if this is a new selection
                     if current_selection_signature != last_processed_selection:
                         last_processed_selection = current_selection_signature
                         
-                        # Get all selected residues (supports multiple selection)
-                        from pymol import stored
-                        stored.selected_residues = []
                         try:
-                            # Use iterate_state to get all selected atoms
-                            cmd.iterate("sele", "stored.selected_residues.append((chain, resi))")
-                            if stored.selected_residues:
-                                # Remove duplicates while preserving order
-                                unique_residues = []
-                                seen = set()
-                                for res in stored.selected_residues:
-                                    if res[0] in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:  # Only protein chains
-                                        try:
-                                            chain, resnum = res
-                                            # Ensure resnum is an integer
-                                            resnum = int(resnum)
-                                            res_key = (chain, resnum)
-                                            if res_key not in seen:
-                                                unique_residues.append(res_key)
-                                                seen.add(res_key)
-                                        except (ValueError, TypeError):
-                                            # Skip invalid residue numbers
-                                            continue
-                                
-                                if not unique_residues:
-                                    print("No valid protein residues selected")
-                                    self.reset_selection_state()
-                                    last_processed_selection = None
-                                    continue
-                                
-                                if len(unique_residues) == 1:
-                                    chain, resnum = unique_residues[0]
-                                    current_state = self.residue_states.get((chain, resnum), 'N')
-                                    is_pocket = (chain, resnum) in self.pocket_residues
-                                    print(f"\nSelected: Chain {chain}, Residue {resnum}")
-                                    print(f"Current status: {self.get_state_description(current_state)}")
-                                    if is_pocket:
-                                        print(f"  Also marked as POCKET residue")
-                                else:
-                                    print(f"\nSelected {len(unique_residues)} residues:")
-                                    # Count residues by state
-                                    state_counts = {'BT': 0, 'B': 0, 'N': 0}
-                                    pocket_count = 0
-                                    for chain, resnum in unique_residues:
-                                        state = self.residue_states.get((chain, resnum), 'N')
-                                        state_counts[state] += 1
-                                        if (chain, resnum) in self.pocket_residues:
-                                            pocket_count += 1
-                                        
-                                    # Print first few and summary
-                                    print(f"  First few: ", end="")
-                                    for i, (chain, resnum) in enumerate(unique_residues[:3]):
-                                        if i > 0:
-                                            print(", ", end="")
-                                        print(f"Chain {chain}, Res {resnum}", end="")
+                            if not unique_residues:
+                                print("No valid protein residues selected")
+                                self.reset_selection_state()
+                                last_processed_selection = None
+                                continue
+                            
+                            # Remember what was shown so the choice can reuse it; keep the copy
+                            # disabled so "sele" stays the active selection that clicks extend
+                            self._select("_shown_sele", "sele", enable=0)
+                            
+                            if len(unique_residues) == 1:
+                                chain, resnum = unique_residues[0]
+                                current_state = self.residue_states.get((chain, resnum), STATE_N)
+                                is_pocket = (chain, resnum) in self.pocket_residues
+                                print(f"\nSelected: Chain {chain}, Residue {resnum}")
+                                print(f"Current status: {self.get_state_description(current_state)}")
+                                if is_pocket:
+                                    print(f"  Also marked as POCKET residue")
+                            else:
+                                print(f"\nSelected {len(unique_residues)} residues:")
+                                # Count residues by state
+                                state_counts = Counter(self.residue_states.get(res_key, STATE_N) for res_key in unique_residues)
+                                pocket_count = len(self.pocket_residues.intersection(unique_residues))
                                     
-                                    if len(unique_residues) > 3:
-                                        print(f", ... and {len(unique_residues) - 3} more")
-                                    else:
-                                        print("")
-                                        
-                                    print(f"  Current states: {state_counts['BT']} fully frozen, {state_counts['B']} backbone-only, {state_counts['N']} not frozen")
-                                    if pocket_count > 0:
-                                        print(f"  Pocket residues: {pocket_count}")
+                                # Print first few and summary
+                                preview = ", ".join(f"Chain {chain}, Res {resnum}" for chain, resnum in unique_residues[:3])
+                                more = f", ... and {len(unique_residues) - 3} more" if len(unique_residues) > 3 else ""
+                                print(f"  First few: {preview}{more}")
+                                    
+                                print(f"  Current states: {state_counts[STATE_BT]} fully frozen, {state_counts[STATE_B]} backbone-only, {state_counts[STATE_N]} not frozen")
+                                if pocket_count > 0:
+                                    print(f"  Pocket residues: {pocket_count}")
+                            
+                            # Wait for state choice
+                            print("Waiting for choice (BT/B/P/N/Q)...")
+                            choice_made = False
+                            while not choice_made:
+                                choice = self._wait_for_input(timeout=SELECTION_POLL_INTERVAL)
                                 
-                                # Wait for state choice
-                                print("Waiting for choice (BT/B/P/N/Q)...")
-                                choice_made = False
-                                while not choice_made:
-                                    time.sleep(0.05)
+                                # Check for PyMOL command
+                                if choice:
+                                    command = choice.upper()
+                                    new_state = _EDIT_STATE_BY_NAME.get(command)
                                     
-                                    # Check for PyMOL command
-                                    if self.pymol_choice:
-                                        new_state = self.pymol_choice.upper()
-                                        self.pymol_choice = None
+                                    if new_state is not None:
+                                        # Only read the selection again if it changed since it was shown
+                                        if cmd.count_atoms("(sele and not _shown_sele) or (_shown_sele and not sele)") > 0:
+                                            unique_residues = self._read_selected_residues()
                                         
-                                        if new_state in ['BT', 'B', 'N']:
-                                            # Get selection right before applying change
-                                            from pymol import stored
-                                            stored.selected_residues = []
-                                            cmd.iterate("sele", "stored.selected_residues.append((chain, resi))")
-                                            
-                                            unique_residues = []
-                                            seen = set()
-                                            for res in stored.selected_residues:
-                                                if res[0] in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-                                                    try:
-                                                        chain, resnum = res
-                                                        resnum = int(resnum)
-                                                        res_key = (chain, resnum)
-                                                        if res_key not in seen:
-                                                            unique_residues.append(res_key)
-                                                            seen.add(res_key)
-                                                    except (ValueError, TypeError):
-                                                        continue
-                                            
-                                            if not unique_residues:
-                                                print("No valid protein residues selected.")
-                                                self.reset_selection_state()
-                                                last_processed_selection = None
-                                                choice_made = False
-                                                continue
-                                            
-                                            # Apply to all selected residues
-                                            updated_count = 0
-                                            for chain, resnum in unique_residues:
-                                                self.residue_states[(chain, resnum)] = new_state
-                                                updated_count += 1
-                                            
-                                            print(f"Updated {updated_count} residue(s) to: {self.get_state_description(new_state)}")
-                                            
-                                            # Immediately update visualization
-                                            self.visualize_current_states()
-                                            choice_made = True
-                                            
-                                            # COMPLETE RESET after change
+                                        if not unique_residues:
+                                            print("No valid protein residues selected.")
                                             self.reset_selection_state()
                                             last_processed_selection = None
-                                            print("\n" + "="*40)
-                                            print("CHANGES APPLIED - READY FOR NEXT SELECTION")
-                                            print("="*40)
-                                            print("Select residue(s) and type choice, or type 'q' to finish...")
-                                            
-                                            # Force a redraw to show the updated visualization
-                                            cmd.refresh()
-                                            
-                                        elif new_state == 'P':
-                                            # Handle pocket toggle
-                                            from pymol import stored
-                                            stored.selected_residues = []
-                                            cmd.iterate("sele", "stored.selected_residues.append((chain, resi))")
-                                            
-                                            unique_residues = []
-                                            seen = set()
-                                            for res in stored.selected_residues:
-                                                if res[0] in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-                                                    try:
-                                                        chain, resnum = res
-                                                        resnum = int(resnum)
-                                                        res_key = (chain, resnum)
-                                                        if res_key not in seen:
-                                                            unique_residues.append(res_key)
-                                                            seen.add(res_key)
-                                                    except (ValueError, TypeError):
-                                                        continue
-                                            
-                                            if not unique_residues:
-                                                print("No valid protein residues selected.")
-                                                self.reset_selection_state()
-                                                last_processed_selection = None
-                                                choice_made = False
-                                                continue
-                                            
+                                            choice_made = False
+                                            continue
+                                        
+                                        if new_state == STATE_P:
                                             # Toggle pocket status for all selected residues
                                             added_count = 0
                                             removed_count = 0
-                                            for chain, resnum in unique_residues:
-                                                res_key = (chain, resnum)
+                                            for res_key in unique_residues:
                                                 if res_key in self.pocket_residues:
                                                     self.pocket_residues.remove(res_key)
                                                     removed_count += 1
@@ -857,28 +913,31 @@ class RFDVIMVisualizer:
                                                 print(f"Added {added_count} residue(s) to pocket")
                                             if removed_count > 0:
                                                 print(f"Removed {removed_count} residue(s) from pocket")
-                                            
-                                            # Immediately update visualization
-                                            self.visualize_current_states()
-                                            choice_made = True
-                                            
-                                            # COMPLETE RESET after change
-                                            self.reset_selection_state()
-                                            last_processed_selection = None
-                                            print("\n" + "="*40)
-                                            print("CHANGES APPLIED - READY FOR NEXT SELECTION")
-                                            print("="*40)
-                                            print("Select residue(s) and type choice, or type 'q' to finish...")
-                                            
-                                            # Force a redraw to show the updated visualization
-                                            cmd.refresh()
-                                            
-                                        elif new_state in ['Q', 'DONE']:
-                                            print("Exiting editing mode...")
-                                            return
                                         else:
-                                            print("Invalid option. Use BT, B, P, N, or Q")
+                                            # Apply to all selected residues
+                                            for res_key in unique_residues:
+                                                self._set_state(res_key, new_state)
                                             
+                                            print(f"Updated {len(unique_residues)} residue(s) to: {self.get_state_description(new_state)}")
+                                        
+                                        # Immediately update visualization
+                                        self.visualize_current_states()
+                                        choice_made = True
+                                        
+                                        # COMPLETE RESET after change
+                                        self.reset_selection_state()
+                                        last_processed_selection = None
+                                        print("\n" + "="*40)
+                                        print("CHANGES APPLIED - READY FOR NEXT SELECTION")
+                                        print("="*40)
+                                        print("Select residue(s) and type choice, or type 'q' to finish...")
+                                        
+                                    elif command in QUIT_CHOICES:
+                                        print("Exiting editing mode...")
+                                        return
+                                    else:
+                                        print("Invalid option. Use BT, B, P, N, or Q")
+                                        
                         except Exception as e:
                             print(f"Error reading selected residue: {e}")
                             self.reset_selection_state()
@@ -890,114 +949,34 @@ class RFDVIMVisualizer:
                 
     def get_state_description(self, state):
         """Get human-readable description of state"""
-        descriptions = {
-            'BT': 'Backbone + Type frozen (green sticks)',
-            'B': 'Backbone only frozen (orange lines)',
-            'N': 'Not frozen (cyan cartoon)'
-        }
-        return descriptions.get(state, 'Unknown')
+        return STATE_DESCRIPTIONS.get(state, 'Unknown')
         
     def generate_contigs_and_inpaint(self):
         """Generate CONTIGS and INPAINT_SEQ strings from current states"""
-        # Get all residues that should be in CONTIGS (BT or B states)
-        contigs_residues = []
-        inpaint_residues = []
-        
-        for (chain, resnum), state in self.residue_states.items():
-            if state in ['BT', 'B']:
-                contigs_residues.append((chain, resnum))
-                if state == 'B':
-                    inpaint_residues.append((chain, resnum))
-                    
-        # Sort residues
-        contigs_residues.sort()
-        inpaint_residues.sort()
-        
-        # Generate CONTIGS string
-        contigs_parts = []
-        if contigs_residues:
-            # Group consecutive residues by chain
-            chain_groups = defaultdict(list)
-            for chain, resnum in contigs_residues:
-                chain_groups[chain].append(resnum)
-                
-            for chain in sorted(chain_groups.keys()):
-                residues = sorted(chain_groups[chain])
-                ranges = self.group_consecutive(residues)
-                for start, end in ranges:
-                    if start == end:
-                        contigs_parts.append(f"{chain}{start}")
-                    else:
-                        contigs_parts.append(f"{chain}{start}-{end}")
-                        
-        # Generate INPAINT_SEQ string
-        inpaint_parts = []
-        if inpaint_residues:
-            chain_groups = defaultdict(list)
-            for chain, resnum in inpaint_residues:
-                chain_groups[chain].append(resnum)
-                
-            for chain in sorted(chain_groups.keys()):
-                residues = sorted(chain_groups[chain])
-                ranges = self.group_consecutive(residues)
-                for start, end in ranges:
-                    if start == end:
-                        inpaint_parts.append(f"{chain}{start}")
-                    else:
-                        inpaint_parts.append(f"{chain}{start}-{end}")
-                        
-        contigs_str = "/".join(contigs_parts) if contigs_parts else ""
-        inpaint_str = "/".join(inpaint_parts) if inpaint_parts else ""
-        
-        return contigs_str, inpaint_str
+        # Reuse the strings until a residue state changes
+        if self._settings_cache is not None:
+            return self._settings_cache
+            
+        # Residue lists are kept sorted by _set_state, so only the chains need ordering
+        self._settings_cache = (
+            _format_ranges(sorted(self._contigs_by_chain.items(), key=itemgetter(0))),
+            _format_ranges(sorted(self._inpaint_by_chain.items(), key=itemgetter(0)))
+        )
+        return self._settings_cache
         
     def generate_pocket_residues(self):
         """Generate POCKET_RESIDUES string from current pocket residues set"""
-        # Get all pocket residues from the set
-        pocket_residues = list(self.pocket_residues)
-                    
-        # Sort residues
-        pocket_residues.sort()
-        
         # Generate POCKET_RESIDUES string
         pocket_parts = []
-        if pocket_residues:
-            chain_groups = defaultdict(list)
-            for chain, resnum in pocket_residues:
-                chain_groups[chain].append(resnum)
-                
-            for chain in sorted(chain_groups.keys()):
-                residues = sorted(chain_groups[chain])
-                ranges = self.group_consecutive(residues)
-                for start, end in ranges:
-                    if start == end:
-                        pocket_parts.append(f"{chain}{start}")
-                    else:
-                        pocket_parts.append(f"{chain}{start}-{end}")
-                        
-        pocket_str = "/".join(pocket_parts) if pocket_parts else ""
-        
-        return pocket_str
-        
-    def group_consecutive(self, numbers):
-        """Group consecutive numbers into ranges"""
-        if not numbers:
-            return []
-            
-        ranges = []
-        start = numbers[0]
-        end = numbers[0]
-        
-        for i in range(1, len(numbers)):
-            if numbers[i] == end + 1:
-                end = numbers[i]
-            else:
-                ranges.append((start, end))
-                start = numbers[i]
-                end = numbers[i]
-                
-        ranges.append((start, end))
-        return ranges
+        for chain, residues in _group_by_chain(self.pocket_residues):
+            ranges = _group_consecutive(residues)
+            for start, end in ranges:
+                if start == end:
+                    pocket_parts.append(f"{chain}{_RESNUM_STRS[start]}")
+                else:
+                    pocket_parts.append(f"{chain}{_RESNUM_STRS[start]}-{_RESNUM_STRS[end]}")
+                    
+        return "/".join(pocket_parts)
         
     def save_settings(self, filename):
         """Save current CONTIGS and INPAINT_SEQ to file"""
@@ -1007,28 +986,39 @@ class RFDVIMVisualizer:
         # Ensure we have a proper path (relative to current dir if not absolute)
         if not os.path.isabs(filename):
             filename = os.path.join(self.current_dir, filename)
-            
+        # Fold "sub/.." parts so makedirs never creates a directory the path only passes through
+        filename = os.path.normpath(filename)
+
         try:
-            # Make sure directory exists
-            dir_path = os.path.dirname(os.path.abspath(filename))
-            if dir_path:  # Only create if directory path exists
+            # Make sure directory exists (filename is absolute and normalized here)
+            dir_path = os.path.dirname(filename)
+            if dir_path not in self._dirs_ensured:
                 os.makedirs(dir_path, exist_ok=True)
+                self._dirs_ensured.add(dir_path)
             
-            # Use context manager for safe file writing
+            # Format the whole file up front and write it with a single unbuffered call
+            payload = (
+                f'CONTIGS="{contigs_str}"\n'
+                f'INPAINT_SEQ="{inpaint_str}"\n'
+                f'POCKET_RESIDUES="{pocket_str}"\n'
+            ).encode('utf-8')
             try:
-                with open(filename, 'w') as f:
-                    f.write(f'CONTIGS="{contigs_str}"\n')
-                    f.write(f'INPAINT_SEQ="{inpaint_str}"\n')
-                    f.write(f'POCKET_RESIDUES="{pocket_str}"\n')
+                fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)  # umask decides, like open()
+                try:
+                    written = 0
+                    while written < len(payload):  # os.write may write less than asked
+                        written += os.write(fd, payload[written:])
+                finally:
+                    os.close(fd)
                 print(f"Settings saved to {filename}")
                 return True
-            except IOError as io_error:
+            except OSError as io_error:
                 print(f"I/O error writing to {filename}: {io_error}")
                 return False
         except Exception as e:
             print(f"Error saving to {filename}: {e}")
-            import traceback
-            traceback.print_exc()
+            if self._debug:
+                traceback.print_exc()
             return False
 
     def save_pse_for_rmsd(self):
@@ -1048,6 +1038,10 @@ class RFDVIMVisualizer:
         objects_created = []
         
         try:
+            # Count each frozen selection once rather than per check below
+            bt_atoms = cmd.count_atoms("frozen_bt")
+            b_atoms = cmd.count_atoms("frozen_b")
+            
             # Create pocket reference if pocket residues exist
             if self.pocket_residues and cmd.count_atoms("pocket") > 0:
                 cmd.create("pocket_RMSD_ref", "pocket")
@@ -1057,7 +1051,7 @@ class RFDVIMVisualizer:
                 print("⚠ Skipping pocket_RMSD_ref (no pocket residues)")
             
             # Create MPNN reference if fully frozen residues exist
-            if cmd.count_atoms("frozen_bt") > 0:
+            if bt_atoms > 0:
                 cmd.create("MPNN_RMSD_ref", "frozen_bt")
                 objects_created.append("MPNN_RMSD_ref (fully frozen residues)")
                 print("✓ Created MPNN_RMSD_ref")
@@ -1065,11 +1059,8 @@ class RFDVIMVisualizer:
                 print("⚠ Skipping MPNN_RMSD_ref (no fully frozen residues)")
             
             # Create combined selection and RFdiff reference
-            bt_atoms = cmd.count_atoms("frozen_bt") if cmd.count_atoms("frozen_bt") > 0 else 0
-            b_atoms = cmd.count_atoms("frozen_b") if cmd.count_atoms("frozen_b") > 0 else 0
-            
             if bt_atoms > 0 or b_atoms > 0:
-                cmd.select("b_and_bt", "frozen_bt or frozen_b")
+                self._select("b_and_bt", "frozen_bt or frozen_b")
                 cmd.create("RFdiff_RMSD_ref", "b_and_bt")
                 objects_created.append("RFdiff_RMSD_ref (all frozen residues)")
                 print("✓ Created RFdiff_RMSD_ref")
@@ -1115,6 +1106,31 @@ class RFDVIMVisualizer:
             print("No filename provided, PSE not saved")
             return False
             
+    def _load_with_txt_fallback(self, name):
+        """Load a saved settings file, trying the name with and without .txt extension"""
+        # Stat each candidate first so missing names never reach the full load path
+        return any(self.load_from_saved_file(candidate)
+                   for candidate in _txt_candidates(name)
+                   if os.path.exists(os.path.join(self.current_dir, candidate)))
+        
+    def _menu_load_settings(self):
+        """Main menu option 3: load settings from a saved file"""
+        filename = self.get_input("Enter filename to load: ", allow_string=True).strip()
+        if filename:
+            if not self._load_with_txt_fallback(filename):
+                print(f"File not found: {filename}")
+                
+            self.visualize_current_states()
+            
+    def _menu_save_settings(self):
+        """Main menu option 4: save settings to a file"""
+        filename = self.get_input("Enter filename to save: ", allow_string=True).strip()
+        if filename:
+            # Ensure file has extension if not provided
+            if not filename.endswith('.txt'):
+                filename += '.txt'
+            self.save_settings(filename)
+            
     def main_menu(self):
         """Main interactive menu"""
         print("\n" + "="*60)
@@ -1128,6 +1144,7 @@ class RFDVIMVisualizer:
             cmd.reinitialize()
             cmd.set("ray_opaque_background", "off")
             cmd.set("antialias", 2)
+            cmd.set("defer_builds_mode", 3)
             time.sleep(0.5)  # Allow graphics to initialize
         except Exception as e:
             print(f"Warning: Graphics initialization issue: {e}")
@@ -1159,19 +1176,7 @@ class RFDVIMVisualizer:
             if choice == '1':
                 save_file = self.get_input("Enter file path to load: ", allow_string=True).strip()
                 if save_file:
-                    # Try with and without .txt extension
-                    found = False
-                    files_to_try = [
-                        save_file,
-                        save_file if save_file.endswith('.txt') else save_file + '.txt'
-                    ]
-                    
-                    for filename in files_to_try:
-                        if self.load_from_saved_file(filename):
-                            found = True
-                            break
-                    
-                    if not found:
+                    if not self._load_with_txt_fallback(save_file):
                         print(f"File not found: {save_file}, starting with empty settings")
                 else:
                     print("No filename provided, starting with empty settings")
@@ -1188,8 +1193,7 @@ class RFDVIMVisualizer:
                 break
             elif choice == '6':
                 print("Goodbye!")
-                cmd.quit()
-                pymol.finish_launching()
+                self.cleanup()
                 sys.exit(0)
             else:
                 print("Invalid choice")
@@ -1214,41 +1218,13 @@ class RFDVIMVisualizer:
                 self.pymol_input_mode = 'menu'
                 choice = self.get_input("\nEnter choice (1-6): ", ['1', '2', '3', '4', '5', '6'])
                 
-                if choice == '1':
-                    self.start_interactive_editing()
-                elif choice == '2':
-                    self.show_current_settings()
-                elif choice == '3':
-                    filename = self.get_input("Enter filename to load: ", allow_string=True).strip()
-                    if filename:
-                        # Try with and without .txt extension
-                        found = False
-                        files_to_try = [
-                            filename,
-                            filename if filename.endswith('.txt') else filename + '.txt'
-                        ]
-                        
-                        for file_to_try in files_to_try:
-                            if self.load_from_saved_file(file_to_try):
-                                found = True
-                                break
-                        
-                        if not found:
-                            print(f"File not found: {filename}")
-                        
-                        self.visualize_current_states()
-                elif choice == '4':
-                    filename = self.get_input("Enter filename to save: ", allow_string=True).strip()
-                    if filename:
-                        # Ensure file has extension if not provided
-                        if not filename.endswith('.txt'):
-                            filename += '.txt'
-                        self.save_settings(filename)
-                elif choice == '5':
-                    self.save_pse_for_rmsd()
-                elif choice == '6':
+                if choice == '6':
                     print("Goodbye!")
                     break
+                    
+                handler = self._menu_dispatch.get(choice)
+                if handler:
+                    handler()
                 else:
                     print("Invalid choice")
                     
@@ -1256,8 +1232,7 @@ class RFDVIMVisualizer:
                 print("\nExiting...")
                 break
                 
-        cmd.quit()
-        pymol.finish_launching()
+        self.cleanup()
         sys.exit(0)
         
     def show_current_settings(self):
@@ -1273,10 +1248,11 @@ class RFDVIMVisualizer:
         print(f'POCKET_RESIDUES="{pocket_str}"')
         print("")
         
-        bt_count = len([s for s in self.residue_states.values() if s == 'BT'])
-        b_count = len([s for s in self.residue_states.values() if s == 'B'])
+        state_counts = Counter(self.residue_states.values())
+        bt_count = state_counts[STATE_BT]
+        b_count = state_counts[STATE_B]
         p_count = len(self.pocket_residues)
-        n_count = len([s for s in self.residue_states.values() if s == 'N'])
+        n_count = state_counts[STATE_N]
         
         print(f"Summary:")
         print(f"  Fully frozen (BT): {bt_count} residues")
@@ -1284,14 +1260,16 @@ class RFDVIMVisualizer:
         print(f"  Pocket residues (P): {p_count} residues")
         print(f"  Not frozen (N): {n_count} residues")
         
-        self.visualize_current_states()
+        # Skip the PyMOL redraw when nothing changed since the last one
+        if self._visual_dirty:
+            self.visualize_current_states()
     
     def cleanup(self):
         """Clean up PyMOL and other resources"""
         if self._pymol_initialized:
             try:
+                # Quit only; finish_launching is a startup call and only delays exit here
                 cmd.quit()
-                pymol.finish_launching()
                 self._pymol_initialized = False
             except Exception as e:
                 print(f"Warning: Error during PyMOL cleanup: {e}")
@@ -1307,6 +1285,7 @@ def main():
     """Main function"""
     parser = argparse.ArgumentParser(description='RFD-VIM (RFDiffusion Visual Input Manager) - PSE Edition')
     parser.add_argument('--help-usage', action='store_true', help='Show detailed usage information')
+    parser.add_argument('--debug', action='store_true', help='Print full tracebacks for handled errors')
     
     args = parser.parse_args()
     
@@ -1340,14 +1319,13 @@ def main():
         return
     
     try:
-        with RFDVIMVisualizer() as visualizer:
+        with RFDVIMVisualizer(debug=args.debug) as visualizer:
             visualizer.main_menu()
     except KeyboardInterrupt:
         print("\nExiting...")
         sys.exit(0)
     except Exception as e:
         print(f"Error: {e}")
-        import traceback
         traceback.print_exc()
         sys.exit(1)
 